@@ -1,6 +1,12 @@
+import atexit
+import logging
+import os
+import queue
+from logging.handlers import QueueHandler, QueueListener
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
+from celery import Celery, Task
 from config import config
 
 # Initialize extensions
@@ -9,6 +15,55 @@ login_manager = LoginManager()
 login_manager.login_view = 'auth.login'
 login_manager.login_message_category = 'info'
 
+def celery_init_app(app):
+    """Create the Celery app bound to this Flask app's context"""
+    class FlaskTask(Task):
+        def __call__(self, *args, **kwargs):
+            with app.app_context():
+                return self.run(*args, **kwargs)
+
+    broker_url = app.config.get('CELERY_BROKER_URL')
+    celery_app = Celery(app.name, task_cls=FlaskTask, include=['app.email_service'])
+    celery_app.conf.update(
+        broker_url=broker_url or 'memory://',
+        # No broker configured (e.g. local dev, Vercel): run tasks inline
+        task_always_eager=not broker_url,
+        task_ignore_result=True,
+        task_serializer='json',
+    )
+    celery_app.set_default()
+    app.extensions['celery'] = celery_app
+    return celery_app
+
+def logging_init_app(app):
+    """Route 'app.*' log records through a queue; a background listener thread
+    does the actual stream I/O so request and task threads never block on it."""
+    logger = logging.getLogger('app')
+    if any(isinstance(h, QueueHandler) for h in logger.handlers):
+        return  # Already configured by an earlier create_app() call
+
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('[%(asctime)s] %(levelname)s in %(module)s: %(message)s'))
+    queue_handler = QueueHandler(queue.Queue(-1))
+
+    def start_listener():
+        listener = QueueListener(queue_handler.queue, handler, respect_handler_level=True)
+        listener.start()
+        atexit.register(listener.stop)
+
+    def restart_listener_in_child():
+        # Forked children (Celery prefork, gunicorn --preload, process pools)
+        # don't inherit the listener thread; give each its own queue and listener.
+        queue_handler.queue = queue.Queue(-1)
+        start_listener()
+
+    start_listener()
+    os.register_at_fork(after_in_child=restart_listener_in_child)
+
+    logger.addHandler(queue_handler)
+    logger.setLevel(logging.DEBUG if app.debug else logging.INFO)
+    logger.propagate = False
+
 def create_app(config_name='default'):
     app = Flask(__name__)
     app.config.from_object(config[config_name])
@@ -16,6 +71,8 @@ def create_app(config_name='default'):
     # Init extensions with app
     db.init_app(app)
     login_manager.init_app(app)
+    logging_init_app(app)
+    celery_init_app(app)
 
     # Register Blueprints
     from app.blueprints.main import main_bp
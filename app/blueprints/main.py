@@ -14,6 +14,31 @@ def inject_company_info():
         return s.value if s else default
     return dict(get_setting=get_setting)
 
+def _claim_daily_low_stock_alert():
+    """True for the first dashboard load of the day, recording the day in settings
+    so concurrent requests and other workers don't send the alert again"""
+    from datetime import date
+    from sqlalchemy import or_, update
+    from sqlalchemy.exc import IntegrityError
+
+    key, today = 'LOW_STOCK_ALERT_LAST_SENT', date.today().isoformat()
+    claimed = db.session.execute(
+        update(Setting)
+        .where(Setting.key == key, or_(Setting.value.is_(None), Setting.value != today))
+        .values(value=today)
+    ).rowcount
+    if not claimed:
+        if Setting.query.filter_by(key=key).first() is not None:
+            db.session.rollback()
+            return False
+        db.session.add(Setting(key=key, value=today))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return False
+    return True
+
 @main_bp.route('/')
 @login_required
 def dashboard():
@@ -86,11 +111,11 @@ def dashboard():
     if low_stock_count > 0:
         try:
             from app.email_service import EmailService
-            all_low_stock = Product.query.filter(
-                Product.stock_quantity <= Product.min_stock_alert
-            ).all()
-            # Only send email once per day per product - you could add more complex logic here
-            EmailService.send_low_stock_alert(all_low_stock)
+            if _claim_daily_low_stock_alert():
+                all_low_stock = Product.query.filter(
+                    Product.stock_quantity <= Product.min_stock_alert
+                ).all()
+                EmailService.send_low_stock_alert(all_low_stock)
         except Exception as e:
             print(f"Low stock email failed: {e}")
     
@@ -145,6 +145,37 @@ def export_csv(type):
         download_name=filename
     )
 
+@reports_bp.route('/reports/low-stock/pdf')
+@login_required
+@role_required('super_admin', 'admin', 'manager')
+def low_stock_pdf():
+    """Download the low stock alert as a PDF"""
+    from app.email_service import EmailService, LOW_STOCK_TMPL
+    from app.email_rows import low_stock_rows
+
+    products = Product.query.filter(
+        Product.stock_quantity <= Product.min_stock_alert
+    ).all()
+    rows = low_stock_rows(products)
+    html = LOW_STOCK_TMPL.render(
+        rows=rows,
+        generated_at=datetime.now().strftime('%Y-%m-%d %I:%M %p')
+    )
+    table_data = [['Product Code', 'Product Name', 'Current Stock', 'Minimum Required']]
+    table_data += [list(row) for row in rows]
+
+    pdf = EmailService.generate_pdf_in_pool(html, table_data)
+    if pdf is None:
+        flash('Failed to generate the low stock PDF.', 'danger')
+        return redirect(url_for('reports.index'))
+
+    return send_file(
+        pdf,
+        mimetype='application/pdf',
+        as_attachment=True,
+        download_name=f"low_stock_{datetime.now().strftime('%Y%m%d')}.pdf"
+    )
+
 @reports_bp.route('/reports/send-daily-summary')
 @login_required
 @role_required('super_admin', 'admin')
@@ -0,0 +1,30 @@
+"""
+Row builders for email tables.
+
+Moved out of email_service so the row shaping is separate from rendering and
+delivery. This is a code move only: no compiled build exists, and the rows are
+read off ORM objects through untyped attribute access, so compiling it would
+not make it faster.
+Values are returned unescaped; the email templates autoescape them.
+"""
+
+from typing import Any, Iterable
+
+LowStockRow = tuple[str, str, int, int]
+PurchaseOrderRow = tuple[str, str, int, str, str]
+
+
+def low_stock_rows(products: Iterable[Any]) -> list[LowStockRow]:
+    """(code, name, current stock, minimum stock) for each product"""
+    return [
+        (p.code, p.name, p.stock_quantity, p.min_stock_alert)
+        for p in products
+    ]
+
+
+def purchase_order_rows(items: Iterable[Any]) -> list[PurchaseOrderRow]:
+    """(code, name, quantity, price, total) for each order item, prices pre-formatted"""
+    return [
+        (i.product.code, i.product.name, i.quantity, format(i.price, '.2f'), format(i.total, '.2f'))
+        for i in items
+    ]
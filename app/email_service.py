@@ -6,116 +6,118 @@ Handles all email notifications including:
 - Daily/Weekly reports
 """
 
+import atexit
+import logging
+import multiprocessing
+import os
+import re
 import resend
-from flask import current_app, render_template_string
-from datetime import datetime
+import resend.version
+import requests
+import threading
+from cachetools import TTLCache
+from celery import shared_task
+from celery.utils.time import get_exponential_backoff_interval
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from flask import current_app
+from jinja2 import BaseLoader, Environment
+from requests.adapters import HTTPAdapter
+from sqlalchemy import func, select
+from sqlalchemy.orm import selectinload
+from urllib3.exceptions import NewConnectionError
+from urllib3.util.retry import Retry
+from datetime import date, datetime, timedelta
+from html import unescape
 from io import BytesIO
+from xml.sax.saxutils import escape
+from app import db
+from app.email_rows import low_stock_rows, purchase_order_rows
+from app.models import Order, OrderItem, Product, Setting, User
 
-class EmailService:
-    """Email notification service using Resend API"""
+logger = logging.getLogger(__name__)
 
-    @staticmethod
-    def generate_pdf(html_content):
-        """Generate a simple PDF from HTML content using reportlab (no system deps)"""
-        try:
-            from reportlab.lib.pagesizes import A4
-            from reportlab.pdfgen import canvas
-            import re
+# Process-local caches so repeated sends don't hit the database every time.
+# Entries live at most ttl seconds per process; a commit made in this process
+# that touches settings or users also clears them straight away (see listeners below).
+_settings_cache = TTLCache(maxsize=256, ttl=60)
+_recipients_cache = TTLCache(maxsize=1, ttl=30)
+_cache_lock = threading.Lock()
 
-            output = BytesIO()
-            c = canvas.Canvas(output, pagesize=A4)
-            # Strip HTML tags for plain text rendering
-            text = re.sub(r'<[^>]+>', ' ', html_content)
-            text = re.sub(r'\s+', ' ', text).strip()
-            width, height = A4
-            c.setFont("Helvetica", 11)
-            y = height - 50
-            for line in text.split('. '):
-                if y < 50:
-                    c.showPage()
-                    y = height - 50
-                c.drawString(40, y, line.strip()[:100])
-                y -= 20
-            c.save()
-            return output.getvalue()
-        except Exception as e:
-            print(f"[ERROR] PDF generation failed: {e}")
-            return None
-    
-    @staticmethod
-    def _get_recipient_emails():
-        """Fetch all active user emails from the database"""
-        from app.models import User
-        try:
-            users = User.query.filter_by(is_active=True).all()
-            emails = [u.email for u in users if u.email]
-            return emails if emails else []
-        except Exception as e:
-            print(f"[RECOVERY] Failed to fetch users: {e}")
-            from app.models import Setting
-            return [Setting.get('ADMIN_EMAIL', current_app.config.get('ADMIN_EMAIL'))]
 
-    @staticmethod
-    def _send_email(to_email, subject, html_content, attachments=None):
-        """Internal method to send email via Resend"""
-        from app.models import Setting
-        try:
-            enable_notifications = Setting.get('ENABLE_EMAIL_NOTIFICATIONS', current_app.config.get('ENABLE_EMAIL_NOTIFICATIONS'))
-            
-            if not enable_notifications:
-                print(f"Email notifications disabled. Would send: {subject} to {to_email}")
-                return False
-            
-            api_key = Setting.get('RESEND_API_KEY', current_app.config.get('RESEND_API_KEY'))
-            resend.api_key = api_key
-            
-            # If to_email is None or empty, use the broadcast list
-            if not to_email:
-                recipients = EmailService._get_recipient_emails()
-            elif isinstance(to_email, list):
-                recipients = to_email
-            else:
-                recipients = [to_email]
-
-            if not recipients:
-                print("[WARNING] No recipients found for email.")
-                return False
-
-            sender = Setting.get('EMAIL_FROM', current_app.config.get('EMAIL_FROM'))
-            admin_email = Setting.get('ADMIN_EMAIL', current_app.config.get('ADMIN_EMAIL'))
-
-            # --- Sandbox Safety Layer ---
-            # Resend sandbox (onboarding@resend.dev) ONLY allows sending to the single verified email.
-            # If we try to broadcast to others, the entire request fails.
-            if 'onboarding@resend.dev' in sender:
-                print(f"[SANDBOX] Restricted sender detected. Filtering recipients to verified email: {admin_email}")
-                recipients = [admin_email]
-            
-            params = {
-                "from": sender,
-                "to": recipients,
-                "subject": subject,
-                "html": html_content,
-                "attachments": attachments or []
-            }
-            
-            email = resend.Emails.send(params)
-            print(f"[SUCCESS] Broadcast email sent to {len(recipients)} users: {subject}")
-            return True
-            
-        except Exception as e:
-            print(f"[ERROR] Email sending failed: {str(e)}")
-            return False
-    
-    @staticmethod
-    def send_low_stock_alert(products):
-        """Send low stock alert email"""
-        from app.models import Setting
-        low_stock_enabled = Setting.get('LOW_STOCK_EMAIL_ENABLED', current_app.config.get('LOW_STOCK_EMAIL_ENABLED'))
-        if not low_stock_enabled:
-            return
-        
-        html = f"""
+def _cached_setting(key, default=None):
+    """Setting.get with a short-lived in-memory cache"""
+    with _cache_lock:
+        if key in _settings_cache:
+            return _settings_cache[key]
+    value = Setting.get(key, default)
+    with _cache_lock:
+        _settings_cache[key] = value
+    return value
+
+
+def _note_cache_changes(session, flush_context):
+    """Remember which caches this transaction's flushes invalidate"""
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, Setting):
+            session.info['clear_settings_cache'] = True
+        elif isinstance(obj, User):
+            session.info['clear_recipients_cache'] = True
+
+
+def _clear_caches_on_commit(session):
+    clear_settings = session.info.pop('clear_settings_cache', False)
+    clear_recipients = session.info.pop('clear_recipients_cache', False)
+    with _cache_lock:
+        if clear_settings:
+            _settings_cache.clear()
+        if clear_recipients:
+            _recipients_cache.clear()
+
+
+def _forget_cache_changes(session, previous_transaction=None):
+    session.info.pop('clear_settings_cache', None)
+    session.info.pop('clear_recipients_cache', None)
+
+
+db.event.listen(db.session, 'after_flush', _note_cache_changes)
+db.event.listen(db.session, 'after_commit', _clear_caches_on_commit)
+db.event.listen(db.session, 'after_rollback', _forget_cache_changes)
+
+# Used by generate_pdf to flatten HTML into plain text
+_TAG_RE = re.compile(rb'<[^>]+>')
+_WS_RE = re.compile(rb'\s+')
+_BLOCK_END_RE = re.compile(rb'</(?:h[1-6]|p|div|tr|li)>|<br\s*/?>', re.IGNORECASE)
+_TABLE_RE = re.compile(rb'<table\b.*?</table>', re.IGNORECASE | re.DOTALL)
+
+_pdf_pool_instance = None
+_pdf_pool_lock = threading.Lock()
+
+
+def _pdf_pool():
+    """Process pool for CPU-bound PDF generation, started on first use"""
+    global _pdf_pool_instance
+    with _pdf_pool_lock:
+        if _pdf_pool_instance is None:
+            _pdf_pool_instance = ProcessPoolExecutor(max_workers=os.cpu_count())
+            atexit.register(_pdf_pool_instance.shutdown, wait=False, cancel_futures=True)
+    return _pdf_pool_instance
+
+
+def _reset_pdf_pool(pool):
+    """Drop a broken pool (a worker died) so the next call starts a fresh one"""
+    global _pdf_pool_instance
+    with _pdf_pool_lock:
+        if _pdf_pool_instance is pool:
+            _pdf_pool_instance = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+# --- Email Templates ---
+# Compiled once at import; autoescape keeps product/vendor names from injecting HTML.
+_template_env = Environment(loader=BaseLoader(), autoescape=True)
+
+LOW_STOCK_TMPL = _template_env.from_string("""
         <h2>⚠️ Low Stock Alert - ERP System</h2>
         <p>The following products are running low on stock:</p>
         <table border="1" cellpadding="10" style="border-collapse: collapse;">
@@ -128,58 +130,26 @@ class EmailService:
                 </tr>
             </thead>
             <tbody>
-        """
-        
-        for product in products:
-            html += f"""
+            {% for code, name, stock_quantity, min_stock_alert in rows %}
                 <tr>
-                    <td>{product.code}</td>
-                    <td>{product.name}</td>
-                    <td style="color: red; font-weight: bold;">{product.stock_quantity}</td>
-                    <td>{product.min_stock_alert}</td>
+                    <td>{{ code }}</td>
+                    <td>{{ name }}</td>
+                    <td style="color: red; font-weight: bold;">{{ stock_quantity }}</td>
+                    <td>{{ min_stock_alert }}</td>
                 </tr>
-            """
-        
-        html += """
+            {% endfor %}
             </tbody>
         </table>
         <p><strong>Action Required:</strong> Please reorder these items to maintain inventory levels.</p>
-        <p style="color: #666; font-size: 12px;">Generated on: """ + datetime.now().strftime('%Y-%m-%d %I:%M %p') + """</p>
-        """
-        
-        # Broadcast to all registered users
-        EmailService._send_email(
-            None, # Passing None triggers the broadcast list in _send_email
-            f"🚨 Low Stock Alert - {len(products)} Products",
-            html
-        )
-    
-    @staticmethod
-    def send_purchase_order_confirmation(order, vendor):
-        """Send purchase order confirmation email"""
-        from app.models import Setting
-        order_email_enabled = Setting.get('ORDER_EMAIL_ENABLED', current_app.config.get('ORDER_EMAIL_ENABLED'))
-        if not order_email_enabled:
-            return
-        
-        items_html = ""
-        for item in order.items:
-            items_html += f"""
-                <tr>
-                    <td>{item.product.code}</td>
-                    <td>{item.product.name}</td>
-                    <td>{item.quantity}</td>
-                    <td>₹{item.price:.2f}</td>
-                    <td>₹{item.total:.2f}</td>
-                </tr>
-            """
-        
-        html = f"""
+        <p style="color: #666; font-size: 12px;">Generated on: {{ generated_at }}</p>
+""")
+
+PURCHASE_ORDER_TMPL = _template_env.from_string("""
         <h2>✅ Purchase Order Confirmation</h2>
-        <p><strong>Order ID:</strong> PO-{order.id}</p>
-        <p><strong>Vendor:</strong> {vendor.name}</p>
-        <p><strong>Date:</strong> {order.date.strftime('%Y-%m-%d %I:%M %p')}</p>
-        <p><strong>Status:</strong> <span style="background-color: #28a745; color: white; padding: 4px 8px; border-radius: 4px;">{order.status}</span></p>
+        <p><strong>Order ID:</strong> PO-{{ order.id }}</p>
+        <p><strong>Vendor:</strong> {{ vendor.name }}</p>
+        <p><strong>Date:</strong> {{ order.date.strftime('%Y-%m-%d %I:%M %p') }}</p>
+        <p><strong>Status:</strong> <span style="background-color: #28a745; color: white; padding: 4px 8px; border-radius: 4px;">{{ order.status }}</span></p>
         
         <h3>Order Items</h3>
         <table border="1" cellpadding="10" style="border-collapse: collapse; width: 100%;">
@@ -193,56 +163,31 @@ class EmailService:
                 </tr>
             </thead>
             <tbody>
-                {items_html}
+            {% for code, name, quantity, price, total in rows %}
+                <tr>
+                    <td>{{ code }}</td>
+                    <td>{{ name }}</td>
+                    <td>{{ quantity }}</td>
+                    <td>₹{{ price }}</td>
+                    <td>₹{{ total }}</td>
+                </tr>
+            {% endfor %}
             </tbody>
             <tfoot>
                 <tr style="background-color: #f0f0f0; font-weight: bold;">
                     <td colspan="4" align="right">Grand Total:</td>
-                    <td>₹{order.grand_total:.2f}</td>
+                    <td>₹{{ grand_total }}</td>
                 </tr>
             </tfoot>
         </table>
         
         <p style="margin-top: 20px;"><strong>✅ Stock has been automatically updated.</strong></p>
         <p style="color: #666; font-size: 12px;">This is an automated notification from ERP System.</p>
-        """
-        
-        # Broadcast to all registered users
-        EmailService._send_email(
-            None,
-            f"Purchase Order Confirmed - PO-{order.id}",
-            html
-        )
-    
-    @staticmethod
-    def send_daily_summary():
-        """Send daily summary report email"""
-        from app.models import Product, Order, Setting
-        from sqlalchemy import func
-        from datetime import date
-        
-        daily_reports_enabled = Setting.get('DAILY_REPORT_EMAIL_ENABLED', current_app.config.get('DAILY_REPORT_EMAIL_ENABLED'))
-        if not daily_reports_enabled:
-            return
-        
-        today = date.today()
-        
-        # Today's stats
-        from app import db
-        
-        today_purchases = db.session.query(func.sum(Order.total_amount)).filter(
-            Order.type == 'PURCHASE',
-            func.date(Order.date) == today
-        ).scalar() or 0
-        
-        low_stock_count = Product.query.filter(
-            Product.stock_quantity <= Product.min_stock_alert
-        ).count()
-        
-        total_products = Product.query.count()
-        
-        html = f"""
-        <h2>📊 Daily Summary Report - {today.strftime('%d %B %Y')}</h2>
+""")
+
+
+DAILY_SUMMARY_TMPL = _template_env.from_string("""
+        <h2>📊 Daily Summary Report - {{ date }}</h2>
         
         <div style="background-color: #f8f9fa; padding: 20px; border-radius: 8px; margin: 20px 0;">
             <h3>Key Metrics</h3>
@@ -252,7 +197,7 @@ class EmailService:
                         <strong>🛒 Today's Purchases:</strong>
                     </td>
                     <td style="padding: 10px; text-align: right; font-size: 20px; color: #ffc107;">
-                        ₹{today_purchases:.2f}
+                        ₹{{ purchases }}
                     </td>
                 </tr>
                 <tr>
@@ -260,7 +205,7 @@ class EmailService:
                         <strong>⚠️ Low Stock Items:</strong>
                     </td>
                     <td style="padding: 10px; text-align: right; font-size: 20px; color: #dc3545;">
-                        {low_stock_count}
+                        {{ low_stock_count }}
                     </td>
                 </tr>
                 <tr>
@@ -268,7 +213,7 @@ class EmailService:
                         <strong>📦 Total Products:</strong>
                     </td>
                     <td style="padding: 10px; text-align: right; font-size: 20px; color: #007bff;">
-                        {total_products}
+                        {{ total_products }}
                     </td>
                 </tr>
             </table>
@@ -276,7 +221,208 @@ class EmailService:
         
         <p><strong>Access your ERP Dashboard:</strong> <a href="http://127.0.0.1:5000">Login to ERP</a></p>
         <p style="color: #666; font-size: 12px;">This is an automated daily report from your ERP System.</p>
-        """
+""")
+
+
+class EmailService:
+    """Email notification service using Resend API"""
+
+    @staticmethod
+    def generate_pdf(html_content, table_data=None):
+        """Generate a PDF from HTML content using reportlab platypus (no system deps).
+        Block-level elements become wrapped paragraphs. Pass table_data (header row
+        plus data rows) to render the email's table as a real reportlab Table.
+        Returns the PDF as a BytesIO stream, or None if generation failed."""
+        try:
+            from reportlab.lib import colors
+            from reportlab.lib.pagesizes import A4
+            from reportlab.lib.styles import getSampleStyleSheet
+            from reportlab.platypus import Paragraph, SimpleDocTemplate, Table, TableStyle
+
+            style = getSampleStyleSheet()['BodyText']
+
+            def paragraphs(fragment):
+                story = []
+                for block in _BLOCK_END_RE.split(fragment):
+                    # Strip HTML tags for plain text rendering
+                    text = _WS_RE.sub(b' ', _TAG_RE.sub(b' ', block)).strip()
+                    if text:
+                        story.append(Paragraph(escape(unescape(text.decode('utf-8'))), style))
+                return story
+
+            output = BytesIO()
+            doc = SimpleDocTemplate(output, pagesize=A4, pageCompression=1)
+
+            content = html_content.encode('utf-8')
+            parts = _TABLE_RE.split(content, maxsplit=1) if table_data else [content]
+            story = paragraphs(parts[0])
+            if table_data:
+                # Wrap cells in paragraphs so long product names wrap instead of overflowing
+                cells = [[Paragraph(escape(str(cell)), style) for cell in row] for row in table_data]
+                col_width = doc.width / max(len(row) for row in table_data)
+                table = Table(cells, colWidths=col_width, repeatRows=1)
+                table.setStyle(TableStyle([
+                    ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+                    ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
+                ]))
+                story.append(table)
+                if len(parts) == 2:
+                    story += paragraphs(parts[1])
+
+            doc.build(story)
+            output.seek(0)
+            return output
+        except Exception as e:
+            logger.error("PDF generation failed: %s", e)
+            return None
+
+    @staticmethod
+    def generate_pdf_in_pool(html_content, table_data=None, timeout=30):
+        """generate_pdf() run in a worker process so PDF layout doesn't hold this
+        process's GIL. Falls back to running inline inside daemonic processes
+        (e.g. Celery prefork workers), which cannot start children of their own."""
+        if multiprocessing.current_process().daemon:
+            return EmailService.generate_pdf(html_content, table_data)
+        pool = _pdf_pool()
+        try:
+            return pool.submit(EmailService.generate_pdf, html_content, table_data).result(timeout=timeout)
+        except BrokenProcessPool as e:
+            logger.error("PDF worker pool broke, restarting it: %s", e)
+            _reset_pdf_pool(pool)
+            return None
+        except Exception as e:
+            logger.error("PDF generation in worker pool failed: %s", e)
+            return None
+
+    @staticmethod
+    def _get_recipient_emails():
+        """Fetch all active user emails from the database"""
+        with _cache_lock:
+            if 'active_user_emails' in _recipients_cache:
+                return _recipients_cache['active_user_emails']
+        try:
+            # Select just the column rather than hydrating full User objects
+            emails = [email for (email,) in db.session.query(User.email).filter(
+                User.is_active.is_(True),
+                User.email.isnot(None),
+                User.email != ''
+            )]
+        except Exception as e:
+            logger.warning("[RECOVERY] Failed to fetch users: %s", e)
+            return [_cached_setting('ADMIN_EMAIL', current_app.config.get('ADMIN_EMAIL'))]
+        with _cache_lock:
+            _recipients_cache['active_user_emails'] = emails
+        return emails
+
+    @staticmethod
+    def _notifications_enabled():
+        """Global email switch, checked before any send_* method does real work"""
+        return _cached_setting('ENABLE_EMAIL_NOTIFICATIONS', current_app.config.get('ENABLE_EMAIL_NOTIFICATIONS'))
+
+    @staticmethod
+    def _send_email(to_email, subject, html_content, attachments=None):
+        """Queue an email for delivery by the background worker"""
+        try:
+            result = _send_email_task.delay(to_email, subject, html_content, attachments)
+            # Without a broker the task has already run inline; report its outcome
+            if _send_email_task.app.conf.task_always_eager:
+                return result.successful() and bool(result.result)
+            return True
+        except Exception as e:
+            logger.error("Failed to queue email: %s", e)
+            return False
+    
+    @staticmethod
+    def send_low_stock_alert(products):
+        """Send low stock alert email"""
+        if not EmailService._notifications_enabled():
+            return
+        
+        low_stock_enabled = _cached_setting('LOW_STOCK_EMAIL_ENABLED', current_app.config.get('LOW_STOCK_EMAIL_ENABLED'))
+        if not low_stock_enabled:
+            return
+        
+        html = LOW_STOCK_TMPL.render(
+            rows=low_stock_rows(products),
+            generated_at=datetime.now().strftime('%Y-%m-%d %I:%M %p')
+        )
+        
+        # Broadcast to all registered users
+        EmailService._send_email(
+            None, # Passing None triggers the broadcast list in _send_email
+            f"🚨 Low Stock Alert - {len(products)} Products",
+            html
+        )
+    
+    @staticmethod
+    def send_purchase_order_confirmation(order, vendor):
+        """Send purchase order confirmation email"""
+        if not EmailService._notifications_enabled():
+            return
+        
+        order_email_enabled = _cached_setting('ORDER_EMAIL_ENABLED', current_app.config.get('ORDER_EMAIL_ENABLED'))
+        if not order_email_enabled:
+            return
+        
+        # Load items and their products up front instead of one query per line
+        order = db.session.get(
+            Order, order.id,
+            options=[selectinload(Order.items).joinedload(OrderItem.product)],
+            populate_existing=True
+        ) or order
+        
+        html = PURCHASE_ORDER_TMPL.render(
+            order=order,
+            vendor=vendor,
+            rows=purchase_order_rows(order.items),
+            grand_total=format(order.grand_total, '.2f')
+        )
+        
+        # Broadcast to all registered users
+        EmailService._send_email(
+            None,
+            f"Purchase Order Confirmed - PO-{order.id}",
+            html
+        )
+    
+    @staticmethod
+    def _render_daily_summary(today):
+        """Daily summary HTML for the given day"""
+        day_start = datetime.combine(today, datetime.min.time())
+        
+        # Today's stats, fetched in a single round-trip
+        today_purchases, low_stock_count, total_products = db.session.execute(select(
+            select(func.coalesce(func.sum(Order.total_amount), 0)).where(
+                Order.type == 'PURCHASE',
+                # Half-open range (not func.date) so the orders.date index is usable
+                Order.date >= day_start,
+                Order.date < day_start + timedelta(days=1)
+            ).scalar_subquery(),
+            select(func.count(Product.id)).where(
+                Product.stock_quantity <= Product.min_stock_alert
+            ).scalar_subquery(),
+            select(func.count(Product.id)).scalar_subquery()
+        )).one()
+        
+        return DAILY_SUMMARY_TMPL.render(
+            date=today.strftime('%d %B %Y'),
+            purchases=format(today_purchases, '.2f'),
+            low_stock_count=low_stock_count,
+            total_products=total_products
+        )
+    
+    @staticmethod
+    def send_daily_summary():
+        """Send daily summary report email"""
+        if not EmailService._notifications_enabled():
+            return
+        
+        daily_reports_enabled = _cached_setting('DAILY_REPORT_EMAIL_ENABLED', current_app.config.get('DAILY_REPORT_EMAIL_ENABLED'))
+        if not daily_reports_enabled:
+            return
+        
+        today = date.today()
+        html = EmailService._render_daily_summary(today)
         
         # Broadcast to all registered users
         EmailService._send_email(
@@ -284,3 +430,208 @@ class EmailService:
             f"📊 Daily Report - {today.strftime('%d %b %Y')}",
             html
         )
+
+
+# Resend accepts up to 100 messages per batch request; keep chunks smaller
+BATCH_SIZE = 50
+MAX_SEND_WORKERS = 8
+
+# Shared keep-alive session for the Resend API, so sends reuse pooled
+# TLS connections instead of handshaking on every request.
+# POSTs are only retried where Resend cannot have accepted the message
+# (connection failures, 429); anything else is left to the Celery task.
+_session = requests.Session()
+_session.mount('https://', HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=32,
+    max_retries=Retry(
+        total=3,
+        read=0,
+        other=0,
+        backoff_factor=0.5,
+        status_forcelist=[429],
+        allowed_methods=frozenset({'POST'}),
+        raise_on_status=False
+    )
+))
+
+
+class TransientEmailError(Exception):
+    """Resend answered 429 or 503, i.e. refused the request without sending"""
+
+
+def _is_retryable(error):
+    """True only where Resend certainly did not accept the request: 429/503
+    or a connection that was never established. Read timeouts and other 5xx
+    may come after the message was queued, so retrying those risks duplicates."""
+    if isinstance(error, (TransientEmailError, requests.ConnectTimeout)):
+        return True
+    if isinstance(error, requests.ConnectionError) and error.args:
+        return isinstance(getattr(error.args[0], 'reason', None), NewConnectionError)
+    return False
+
+
+def _resend_post(path, payload, api_key):
+    """POST to the Resend API over the shared session. Raises TransientEmailError
+    on 429/503 and ResendError (or HTTPError) on other API errors."""
+    resp = _session.post(
+        f"{resend.api_url}{path}",
+        json=payload,
+        headers={
+            "Accept": "application/json",
+            "Authorization": f"Bearer {api_key}",
+            "User-Agent": f"resend-python:{resend.version.get_version()}"
+        },
+        timeout=30
+    )
+    if resp.status_code in (429, 503):
+        raise TransientEmailError(f"Resend API returned HTTP {resp.status_code}")
+    try:
+        body = resp.json()
+    except ValueError:
+        body = None
+    if resp.status_code != 200 and isinstance(body, dict) and body.get("statusCode"):
+        resend.exceptions.raise_for_code_and_type(
+            code=body.get("statusCode"),
+            message=body.get("message"),
+            error_type=body.get("name")
+        )
+    resp.raise_for_status()
+    return body
+
+
+def _send_one(message, api_key):
+    """Send one message via /emails. Returns (sent, [(message, error)])"""
+    try:
+        _resend_post('/emails', message, api_key)
+        return 1, []
+    except Exception as e:
+        logger.error("Failed to deliver email to %s: %s", message['to'][0], e)
+        return 0, [(message, e)]
+
+
+def _status_code(error):
+    """HTTP status behind a Resend/requests error, or None"""
+    if isinstance(error, resend.exceptions.ResendError):
+        try:
+            return int(error.code)
+        except (TypeError, ValueError):
+            return None
+    response = getattr(error, 'response', None)
+    return getattr(response, 'status_code', None)
+
+
+def _send_chunk(chunk, api_key):
+    """Send a chunk via /emails/batch. Returns (sent, [(message, error)]).
+    One rejected address fails the whole batch request, so on a validation
+    error (400/422) the chunk is resent one message at a time. Account-wide
+    errors (401/403 bad key or unverified domain, 5xx) fail the chunk once."""
+    if len(chunk) == 1:
+        return _send_one(chunk[0], api_key)
+    try:
+        _resend_post('/emails/batch', [{k: v for k, v in m.items() if k != 'attachments'} for m in chunk], api_key)
+        return len(chunk), []
+    except Exception as e:
+        if _is_retryable(e):
+            # Individual sends would hit the same outage; let the task retry the chunk
+            logger.error("Failed to deliver batch of %d message(s): %s", len(chunk), e)
+            return 0, [(m, e) for m in chunk]
+        if _status_code(e) not in (400, 422):
+            # Not something a single recipient can cause; every send would fail the same way
+            logger.error("Failed to deliver batch of %d message(s): %s", len(chunk), e)
+            return 0, [(m, e) for m in chunk]
+        logger.warning("Batch of %d message(s) rejected, sending individually: %s", len(chunk), e)
+
+    sent, failed = 0, []
+    for message in chunk:
+        ok, errors = _send_one(message, api_key)
+        sent += ok
+        failed += errors
+    return sent, failed
+
+
+def _deliver_messages(messages, api_key):
+    """Send single-recipient messages concurrently, in batches where possible.
+    Returns (sent count, [(message, error)] for every message not delivered)."""
+    # The batch endpoint does not support attachments
+    if not any(m['attachments'] for m in messages):
+        jobs = [(_send_chunk, messages[i:i + BATCH_SIZE]) for i in range(0, len(messages), BATCH_SIZE)]
+    else:
+        jobs = [(_send_one, m) for m in messages]
+
+    sent, failed = 0, []
+    with ThreadPoolExecutor(max_workers=min(MAX_SEND_WORKERS, len(jobs))) as executor:
+        futures = [executor.submit(send, payload, api_key) for send, payload in jobs]
+        for future in as_completed(futures):
+            ok, errors = future.result()
+            sent += ok
+            failed += errors
+    return sent, failed
+
+
+@shared_task(bind=True, max_retries=5)
+def _send_email_task(self, to_email, subject, html_content, attachments=None):
+    """Send an email via Resend. Runs on the Celery worker; settings are
+    resolved here so the queued payload only carries the message itself."""
+    try:
+        # Re-checked here: the switch may have been turned off while the task was queued
+        if not EmailService._notifications_enabled():
+            logger.info("Email notifications disabled. Would send: %s to %s", subject, to_email)
+            return False
+        
+        api_key = _cached_setting('RESEND_API_KEY', current_app.config.get('RESEND_API_KEY'))
+        
+        # If to_email is None or empty, use the broadcast list
+        if not to_email:
+            recipients = EmailService._get_recipient_emails()
+        elif isinstance(to_email, list):
+            recipients = to_email
+        else:
+            recipients = [to_email]
+
+        if not recipients:
+            logger.warning("No recipients found for email.")
+            return False
+
+        sender = _cached_setting('EMAIL_FROM', current_app.config.get('EMAIL_FROM'))
+        admin_email = _cached_setting('ADMIN_EMAIL', current_app.config.get('ADMIN_EMAIL'))
+
+        # --- Sandbox Safety Layer ---
+        # Resend sandbox (onboarding@resend.dev) ONLY allows sending to the single verified email.
+        # If we try to broadcast to others, the entire request fails.
+        if 'onboarding@resend.dev' in sender:
+            logger.info("[SANDBOX] Restricted sender detected. Filtering recipients to verified email: %s", admin_email)
+            recipients = [admin_email]
+        
+        # One message per recipient so addresses are never exposed to each other
+        # and a single rejected address cannot fail the whole broadcast.
+        messages = [
+            {
+                "from": sender,
+                "to": [recipient],
+                "subject": subject,
+                "html": html_content,
+                "attachments": attachments or []
+            }
+            for recipient in recipients
+        ]
+        
+        sent, failed = _deliver_messages(messages, api_key)
+        logger.info("Broadcast email sent to %d/%d users: %s", sent, len(recipients), subject)
+        retryable = [(message['to'][0], e) for message, e in failed if _is_retryable(e)]
+    
+    except Exception as e:
+        logger.error("Email sending failed: %s", e)
+        return False
+
+    # Transient failures are retried with exponential backoff, for the failed
+    # recipients only so nobody already served gets a duplicate. Not when
+    # running inline in the web request: there is no worker to back off on.
+    if retryable and not self.request.is_eager:
+        logger.warning("Retrying %d recipient(s) (%d/%d): %s", len(retryable), self.request.retries, self.max_retries, retryable[0][1])
+        raise self.retry(
+            args=([recipient for recipient, _ in retryable], subject, html_content, attachments),
+            exc=retryable[0][1],
+            countdown=get_exponential_backoff_interval(1, self.request.retries, 600, full_jitter=True)
+        )
+    return sent > 0
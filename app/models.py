@@ -10,6 +10,11 @@ class Setting(db.Model):
     key = db.Column(db.String(50), unique=True, nullable=False)
     value = db.Column(db.Text)
 
+    @classmethod
+    def get(cls, key, default=None):
+        setting = cls.query.filter_by(key=key).first()
+        return setting.value if setting else default
+
 # --- Authentication Models ---
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
@@ -99,6 +104,10 @@ class Customer(db.Model):
 # --- Common Order Models (Purchase & Sales) ---
 class Order(db.Model):
     __tablename__ = 'orders'
+    __table_args__ = (
+        db.Index('idx_orders_type_date', 'type', 'date'),  # Daily purchase/sales totals
+        db.Index('idx_orders_date', 'date'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     type = db.Column(db.String(10), nullable=False) # 'PURCHASE' or 'SALE'
     
@@ -0,0 +1,8 @@
+from app import create_app
+import os
+
+app = create_app(os.getenv('FLASK_CONFIG') or 'default')
+celery_app = app.extensions['celery']
+
+# Start a worker with:
+#   celery -A celery_worker.celery_app worker --loglevel=info
@@ -26,6 +26,9 @@ class Config:
     LOW_STOCK_EMAIL_ENABLED = True
     ORDER_EMAIL_ENABLED = True
     DAILY_REPORT_EMAIL_ENABLED = True
+
+    # Background Tasks (Celery) - emails are sent inline when no broker is set
+    CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL')  # e.g. redis://localhost:6379/0
     
     # Pagination
     ITEMS_PER_PAGE = 20
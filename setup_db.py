@@ -1,5 +1,5 @@
 from app import create_app, db
-from app.models import User
+from app.models import User, Order
 
 app = create_app('development')
 
@@ -9,6 +9,11 @@ def setup_database():
         db.create_all()
         print("Database tables created.")
 
+        # create_all() skips indexes on tables that already exist
+        for index in Order.__table__.indexes:
+            index.create(db.engine, checkfirst=True)
+        print("Order indexes ensured.")
+
         # Check if admin exists
         if not User.query.filter_by(username='admin').first():
             admin = User(